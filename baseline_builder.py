@@ -4,16 +4,48 @@ MCP Baseline Builder
 Builds baseline from actual session data
 """
 
+import hashlib
 import json
+import math
 import os
+import orjson
 from pathlib import Path
 from collections import defaultdict, Counter
 from datetime import datetime
-import pickle
 from typing import Dict, List, Set
 
 # Import existing detector
-from mcp_anomaly_detector import SimpleTopicAnomalyDetector
+from mcp_anomaly_detector import SimpleTopicAnomalyDetector, probe_query_field
+
+
+class HyperLogLog:
+    """Approximate distinct counter using 2**p one-byte registers"""
+    
+    def __init__(self, p: int = 14):
+        self.p = p
+        self.m = 1 << p
+        self.registers = bytearray(self.m)
+    
+    def update(self, value: bytes):
+        """Add a value to the counter"""
+        x = int.from_bytes(hashlib.blake2b(value, digest_size=8).digest(), 'big')
+        idx = x >> (64 - self.p)
+        rest = x & ((1 << (64 - self.p)) - 1)
+        rank = (64 - self.p) - rest.bit_length() + 1
+        if rank > self.registers[idx]:
+            self.registers[idx] = rank
+    
+    def count(self) -> int:
+        """Estimate the number of distinct values added"""
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        estimate = alpha * self.m * self.m / sum(2.0 ** -r for r in self.registers)
+        
+        # Small-range correction: linear counting over empty registers
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * self.m and zeros:
+            estimate = self.m * math.log(self.m / zeros)
+        
+        return round(estimate)
 
 
 class BaselineBuilder:
@@ -24,10 +56,12 @@ class BaselineBuilder:
         self.detector = SimpleTopicAnomalyDetector(sensitivity=0.7)
         self.stats = defaultdict(lambda: {
             'total_calls': 0,
-            'unique_queries': set(),
+            'unique_queries': HyperLogLog(),  # Approximate distinct query count
+            'sample_queries': [],             # First 10 distinct queries
             'tools': Counter(),
             'sessions': set()
         })
+        self._session_count = 0  # Set by build_baseline
         
     def build_baseline(self):
         """Build baseline from all sessions"""
@@ -35,6 +69,7 @@ class BaselineBuilder:
         
         # Get session directories
         session_dirs = [d for d in self.data_dir.iterdir() if d.is_dir() and d.name.startswith('session_')]
+        self._session_count = len(session_dirs)
         
         if not session_dirs:
             print(f"No session directories found in {self.data_dir}")
@@ -59,10 +94,13 @@ class BaselineBuilder:
             session_tools_calls = 0
             
             # Read requests.jsonl
-            with open(requests_file, 'r', encoding='utf-8') as f:
+            with open(requests_file, 'rb', buffering=1 << 23) as f:
                 for line in f:
+                    # Cheap substring check before parsing; the parsed method is still verified below
+                    if b'"tools/call"' not in line:
+                        continue
                     try:
-                        data = json.loads(line.strip())
+                        data = orjson.loads(line)
                         
                         # Extract only tools/call
                         if data.get('parsed', {}).get('method') == 'tools/call':
@@ -82,12 +120,16 @@ class BaselineBuilder:
                             args = params.get('arguments', {})
                             query_text = self._extract_query_text(args)
                             if query_text:
-                                self.stats[service_name]['unique_queries'].add(query_text)
+                                service_stats = self.stats[service_name]
+                                service_stats['unique_queries'].update(query_text.encode('utf-8'))
+                                samples = service_stats['sample_queries']
+                                if len(samples) < 10 and query_text not in samples:
+                                    samples.append(query_text)
                             
                             # Train detector
                             self.detector.learn(data)
                             
-                    except json.JSONDecodeError as e:
+                    except orjson.JSONDecodeError as e:
                         print(f"  JSON decode error: {e}")
                     except Exception as e:
                         print(f"  Error processing line: {e}")
@@ -112,9 +154,9 @@ class BaselineBuilder:
     def _extract_query_text(self, args: dict) -> str:
         """Extract query text from arguments"""
         # Check various field names
-        for field in ['query', 'q', 'search', 'text', 'sql', 'command', 'prompt', 'pattern', 'message']:
-            if field in args:
-                return str(args[field])
+        query_text = probe_query_field(args)
+        if query_text is not None:
+            return query_text
         
         # Special cases
         if 'block_id' in args:
@@ -137,7 +179,7 @@ class BaselineBuilder:
         for service, stats in sorted(self.stats.items()):
             print(f"Service: {service}")
             print(f"  Total calls: {stats['total_calls']}")
-            print(f"  Unique queries: {len(stats['unique_queries'])}")
+            print(f"  Unique queries: {stats['unique_queries'].count()}")
             print(f"  Sessions: {len(stats['sessions'])}")
             print(f"  Tools used:")
             
@@ -145,9 +187,9 @@ class BaselineBuilder:
                 print(f"    - {tool}: {count} calls")
             
             # Display sample queries
-            if stats['unique_queries']:
+            if stats['sample_queries']:
                 print(f"  Sample queries:")
-                for i, query in enumerate(list(stats['unique_queries'])[:3]):
+                for i, query in enumerate(stats['sample_queries'][:3]):
                     print(f"    - {query[:60]}{'...' if len(query) > 60 else ''}")
             
             print()
@@ -170,17 +212,26 @@ class BaselineBuilder:
     
     def _save_baseline(self):
         """Save baseline to file"""
-        baseline_file = Path("mcp_baseline.pkl")
+        baseline_file = Path("mcp_baseline.json")
         
         baseline_data = {
-            'detector': self.detector,
-            'stats': dict(self.stats),
+            'detector': self.detector.get_state(),
+            'stats': {
+                service: {
+                    'total_calls': stats['total_calls'],
+                    'unique_queries': stats['unique_queries'].count(),
+                    'sample_queries': stats['sample_queries'],
+                    'tools': dict(stats['tools']),
+                    'sessions': sorted(stats['sessions'])
+                }
+                for service, stats in self.stats.items()
+            },
             'created_at': datetime.now().isoformat(),
-            'total_sessions': len([d for d in self.data_dir.iterdir() if d.is_dir() and d.name.startswith('session_')])
+            'total_sessions': self._session_count
         }
         
         with open(baseline_file, 'wb') as f:
-            pickle.dump(baseline_data, f)
+            f.write(orjson.dumps(baseline_data))
         
         print(f"Baseline saved to {baseline_file}")
         
@@ -195,9 +246,9 @@ class BaselineBuilder:
         for service, stats in self.stats.items():
             json_data['services'][service] = {
                 'total_calls': stats['total_calls'],
-                'unique_queries': len(stats['unique_queries']),
+                'unique_queries': stats['unique_queries'].count(),
                 'tools': dict(stats['tools']),
-                'sample_queries': list(stats['unique_queries'])[:10]
+                'sample_queries': stats['sample_queries']
             }
         
         with open(json_file, 'w', encoding='utf-8') as f:
@@ -206,15 +257,15 @@ class BaselineBuilder:
         print(f"Summary saved to {json_file}")
 
 
-def test_anomaly_detection(baseline_file: str = "mcp_baseline.pkl"):
+def test_anomaly_detection(baseline_file: str = "mcp_baseline.json"):
     """Test anomaly detection with saved baseline"""
     print("\n=== Testing Anomaly Detection ===\n")
     
     # Load baseline
     with open(baseline_file, 'rb') as f:
-        baseline_data = pickle.load(f)
+        baseline_data = orjson.loads(f.read())
     
-    detector = baseline_data['detector']
+    detector = SimpleTopicAnomalyDetector.from_state(baseline_data['detector'])
     
     # Test cases
     test_cases = [
@@ -286,9 +337,10 @@ def test_anomaly_detection(baseline_file: str = "mcp_baseline.pkl"):
         }
     ]
     
-    for i, test_case in enumerate(test_cases, 1):
+    results = detector.detect_anomaly_batch(test_cases)
+    
+    for i, result in enumerate(results, 1):
         print(f"\nTest Case {i}:")
-        result = detector.detect_anomaly(test_case)
         
         tool = result.get('tool', 'unknown')
         query = result.get('query', 'N/A')
@@ -311,7 +363,7 @@ def main():
     all_requests = builder.build_baseline()
     
     # Test anomaly detection
-    if Path("mcp_baseline.pkl").exists():
+    if Path("mcp_baseline.json").exists():
         test_anomaly_detection()
 
 
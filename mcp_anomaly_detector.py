@@ -6,11 +6,53 @@ Detects topic changes in MCP requests
 
 import json
 import re
-from collections import defaultdict, Counter
+import sys
+from collections import Counter
 from datetime import datetime
-from typing import Dict, List, Set, Optional
+from functools import lru_cache
+from typing import Dict, FrozenSet, List, Set, Optional
 import logging
 
+# Tokenizer patterns, compiled once at import. _TOKEN matches whole runs of 2+
+# lowercase alphanumerics and rejects stopwords inside the regex engine
+_STOPWORDS = ('the', 'is', 'at', 'to', 'for', 'of', 'and', 'or', 'in', 'on', 'by', 'with', 'from')
+_CAMEL = re.compile(r'([a-z])([A-Z])')
+_TOKEN = re.compile(r'(?<![a-z0-9])(?!(?:%s)(?![a-z0-9]))[a-z0-9]{2,}' % '|'.join(_STOPWORDS))
+
+
+@lru_cache(maxsize=8192)
+def _tokenize(text: str) -> FrozenSet[str]:
+    """Tokenize text into topics (memoized, as identical queries repeat often)"""
+    # Split camelCase (e.g., CustomerSupport → customer support), then lowercase.
+    # Text that is already lowercase has no camelCase boundary, so skip the substitution
+    if not text.islower():
+        text = _CAMEL.sub(r'\1 \2', text).lower()
+    
+    # Extract words (2+ alphanumeric characters, stopwords excluded).
+    # Interning shares one string object per distinct topic across all tools
+    return frozenset(map(sys.intern, _TOKEN.findall(text)))
+
+
+def _compile_field_probe(fields: tuple):
+    """Generate a function returning str(args[f]) for the first field f in args, else None
+    
+    The field checks are unrolled into straight-line code, so there is no loop over
+    the field list per call.
+    """
+    src = "def probe(args):\n"
+    for field in fields:
+        src += f"    if {field!r} in args:\n        return str(args[{field!r}])\n"
+    src += "    return None\n"
+    namespace = {}
+    exec(src, namespace)
+    return namespace['probe']
+
+
+# Argument fields holding query text, in priority order
+QUERY_FIELDS = ('query', 'q', 'search', 'text', 'sql', 'command', 'prompt', 'pattern', 'message')
+probe_query_field = _compile_field_probe(QUERY_FIELDS)
+
+
 class SimpleTopicAnomalyDetector:
     """Topic-based anomaly detector for MCP requests"""
     
@@ -19,34 +61,28 @@ class SimpleTopicAnomalyDetector:
         Args:
             sensitivity: Detection sensitivity (0.0-1.0). Higher values detect more anomalies
         """
-        self.tool_topics = defaultdict(Counter)  # Topic history per tool
-        self.tool_keywords = defaultdict(set)    # Keyword set per tool
+        self.tool_topics: Dict[str, Counter] = {}    # Topic history per tool (keys double as keyword set)
         self.sensitivity = sensitivity
         self.min_history = 3  # Minimum history required
+        self._top_cache: Dict[str, list] = {}  # Cached most_common(5) per tool
+        self._top_dirty: Set[str] = set()      # Tools learned since last cache fill
+        self._tool_total: Dict[str, int] = {}  # Running sum of tool_topics[tool] counts
         
         # Logging setup
         logging.basicConfig(level=logging.INFO)
         self.logger = logging.getLogger(__name__)
     
-    def extract_topics(self, text: str) -> Set[str]:
+    def __setstate__(self, state):
+        """Restore pickled state, resetting caches missing from older baselines"""
+        self.__dict__.update(state)
+        self.__dict__.pop('tool_keywords', None)  # Duplicated tool_topics keys in older baselines
+        self._top_cache = {}
+        self._top_dirty = set()
+        self._tool_total = {tool: sum(topics.values()) for tool, topics in self.tool_topics.items()}
+    
+    def extract_topics(self, text: str) -> FrozenSet[str]:
         """Extract main topics (keywords) from text"""
-        # Convert to lowercase
-        text = text.lower()
-        
-        # Split camelCase (e.g., CustomerSupport → customer support)
-        text = re.sub(r'([a-z])([A-Z])', r'\1 \2', text)
-        
-        # Replace symbols with spaces
-        text = re.sub(r'[^a-z0-9\s]', ' ', text)
-        
-        # Extract words (2+ characters)
-        words = [w for w in text.split() if len(w) >= 2]
-        
-        # Remove common stopwords
-        stopwords = {'the', 'is', 'at', 'to', 'for', 'of', 'and', 'or', 'in', 'on', 'by', 'with', 'from'}
-        words = [w for w in words if w not in stopwords]
-        
-        return set(words)
+        return _tokenize(text)
     
     def learn(self, request: dict):
         """Learn from normal request patterns"""
@@ -57,15 +93,37 @@ class SimpleTopicAnomalyDetector:
         topics = self.extract_topics(query_text)
         
         # Record topics
-        for topic in topics:
-            self.tool_topics[tool_name][topic] += 1
-            self.tool_keywords[tool_name].add(topic)
+        tt = self.tool_topics.get(tool_name)
+        if tt is None:
+            tt = self.tool_topics[tool_name] = Counter()
+        tt.update(topics)
+        self._top_dirty.add(tool_name)
+        self._tool_total[tool_name] = self._tool_total.get(tool_name, 0) + len(topics)
         
         self.logger.debug(f"Learned topics for {tool_name}: {topics}")
     
     def detect_anomaly(self, request: dict) -> Dict:
         """Detect anomalies in request"""
         tool_name, query_text = self._extract_info(request)
+        return self._detect(tool_name, query_text, request.get('timestamp', ''))
+    
+    def detect_anomaly_batch(self, requests: List[dict]) -> List[Dict]:
+        """Detect anomalies in many requests, scoring each distinct (tool, query) once"""
+        results = []
+        scored = {}
+        for request in requests:
+            tool_name, query_text = self._extract_info(request)
+            timestamp = request.get('timestamp', '')
+            result = scored.get((tool_name, query_text))
+            if result is None:
+                result = scored[(tool_name, query_text)] = self._detect(tool_name, query_text, timestamp)
+            else:
+                result = dict(result, timestamp=timestamp)
+            results.append(result)
+        return results
+    
+    def _detect(self, tool_name: Optional[str], query_text: Optional[str], timestamp: str) -> Dict:
+        """Score extracted tool name and query text against learned topics"""
         if not tool_name or not query_text:
             return {
                 'is_anomaly': False, 
@@ -77,11 +135,11 @@ class SimpleTopicAnomalyDetector:
                 'new_topics': [],
                 'known_topics': [],
                 'common_topics': [],
-                'timestamp': request.get('timestamp', '')
+                'timestamp': timestamp
             }
         
         # Skip if insufficient history
-        if sum(self.tool_topics[tool_name].values()) < self.min_history:
+        if self._tool_total.get(tool_name, 0) < self.min_history:
             return {
                 'is_anomaly': False,
                 'reason': f'Insufficient history for {tool_name}',
@@ -92,30 +150,46 @@ class SimpleTopicAnomalyDetector:
                 'new_topics': [],
                 'known_topics': [],
                 'common_topics': [],
-                'timestamp': request.get('timestamp', '')
+                'timestamp': timestamp
             }
         
-        # Extract current query topics
+        # Extract current query topics; without any there is nothing to score
         current_topics = self.extract_topics(query_text)
+        if not current_topics:
+            return {
+                'is_anomaly': False,
+                'reason': 'No topics found in query',
+                'confidence': 0.0,
+                'tool': tool_name,
+                'query': query_text,
+                'current_topics': [],
+                'new_topics': [],
+                'known_topics': [],
+                'common_topics': [],
+                'timestamp': timestamp
+            }
         
-        # Check overlap with known topics
-        known_topics = self.tool_keywords[tool_name]
-        overlap = current_topics.intersection(known_topics)
+        # Split current topics into known (overlap) and new in a single pass
+        known_topics = self.tool_topics[tool_name]
+        overlap = []
+        new_topics = []
+        for topic in current_topics:
+            if topic in known_topics:
+                overlap.append(topic)
+            else:
+                new_topics.append(topic)
         
         # Calculate new topic ratio
-        if not current_topics:
-            new_topic_ratio = 0
-        else:
-            new_topic_ratio = 1 - (len(overlap) / len(current_topics))
+        new_topic_ratio = 1 - (len(overlap) / len(current_topics))
         
         # Anomaly determination
         is_anomaly = new_topic_ratio >= self.sensitivity
         
-        # Identify new topics
-        new_topics = current_topics - known_topics
-        
-        # Find most common existing topics
-        top_existing_topics = self.tool_topics[tool_name].most_common(5)
+        # Find most common existing topics (recomputed only after learning)
+        if tool_name in self._top_dirty or tool_name not in self._top_cache:
+            self._top_cache[tool_name] = self.tool_topics[tool_name].most_common(5)
+            self._top_dirty.discard(tool_name)
+        top_existing_topics = self._top_cache[tool_name]
         
         result = {
             'is_anomaly': is_anomaly,
@@ -123,10 +197,10 @@ class SimpleTopicAnomalyDetector:
             'tool': tool_name,
             'query': query_text,
             'current_topics': list(current_topics),
-            'new_topics': list(new_topics),
-            'known_topics': list(overlap),
+            'new_topics': new_topics,
+            'known_topics': overlap,
             'common_topics': [t[0] for t in top_existing_topics],
-            'timestamp': request.get('timestamp', '')
+            'timestamp': timestamp
         }
         
         if is_anomaly:
@@ -141,15 +215,11 @@ class SimpleTopicAnomalyDetector:
         try:
             parsed = request.get('parsed', {})
             params = parsed.get('params', {})
-            tool_name = params.get('name', '')
+            tool_name = sys.intern(params.get('name', ''))
             args = params.get('arguments', {})
             
             # Extract query text from various field names
-            query_text = None
-            for field in ['query', 'q', 'search', 'text', 'sql', 'command', 'prompt', 'pattern', 'message']:
-                if field in args:
-                    query_text = str(args[field])
-                    break
+            query_text = probe_query_field(args)
             
             # Handle special cases (block_id, cve_id, etc.)
             if not query_text:
@@ -173,12 +243,46 @@ class SimpleTopicAnomalyDetector:
         except:
             return None, None
     
+    def get_state(self) -> Dict:
+        """Get learned state as plain lists (parallel topics/counts per tool)"""
+        return {
+            'sensitivity': self.sensitivity,
+            'min_history': self.min_history,
+            'tools': {
+                tool: {'topics': list(topics.keys()), 'counts': list(topics.values())}
+                for tool, topics in self.tool_topics.items()
+            }
+        }
+    
+    @classmethod
+    def from_state(cls, state: Dict) -> 'SimpleTopicAnomalyDetector':
+        """Rebuild a detector from get_state() output"""
+        detector = cls(sensitivity=state['sensitivity'])
+        detector.min_history = state.get('min_history', detector.min_history)
+        for tool, block in state['tools'].items():
+            tool = sys.intern(tool)
+            topics = [sys.intern(t) for t in block['topics']]
+            detector.tool_topics[tool] = Counter(dict(zip(topics, block['counts'])))
+            detector._tool_total[tool] = sum(block['counts'])
+        detector.warm_up()
+        return detector
+
+    def warm_up(self):
+        """Fill per-tool caches up front so the first detection per tool pays no setup cost"""
+        for tool in self._top_dirty | (self.tool_topics.keys() - self._top_cache.keys()):
+            self._top_cache[tool] = self.tool_topics[tool].most_common(5)
+        self._top_dirty.clear()
+    
+    def total_requests(self) -> int:
+        """Get the learned topic count summed over all tools"""
+        return sum(self._tool_total.values())
+    
     def get_summary(self) -> Dict:
         """Get summary of learned content"""
         summary = {}
         for tool, topics in self.tool_topics.items():
             summary[tool] = {
-                'total_requests': sum(topics.values()),
+                'total_requests': self._tool_total.get(tool, 0),
                 'unique_topics': len(topics),
                 'top_topics': topics.most_common(10)
             }
@@ -4,9 +4,13 @@ MCP Proxy with NPX fix
 """
 
 import sys
+import os
+import atexit
+import queue
+import selectors
 import subprocess
 import threading
-import json
+import orjson
 from datetime import datetime
 from pathlib import Path
 
@@ -24,15 +28,33 @@ session_name = f"session_{session_id}_{sys.argv[1] if len(sys.argv) > 1 else 'un
 session_dir = data_dir / session_name
 session_dir.mkdir(exist_ok=True)
 
+# Keep output files open for the proxy lifetime. Session files are unbuffered
+# and the log is flushed per line, so the realtime monitor sees entries immediately
+log_handle = open(log_file, 'ab')
+session_files = {
+    direction: open(session_dir / f"{direction}s.jsonl", 'ab', buffering=0)
+    for direction in ("request", "response")
+}
+
+def close_files():
+    """Flush and close log and session files"""
+    for f in [log_handle, *session_files.values()]:
+        try:
+            f.close()
+        except Exception:
+            pass
+
+atexit.register(close_files)
+
 def log(message):
     """Log to file only"""
-    with open(log_file, 'a', encoding='utf-8') as f:
-        f.write(f"{datetime.now().isoformat()} - {message}\n")
+    log_handle.write(f"{datetime.now().isoformat()} - {message}\n".encode('utf-8'))
+    log_handle.flush()
 
 def save_message(content, direction):
     """Save message to session file"""
     try:
-        file_path = session_dir / f"{direction}s.jsonl"
+        f = session_files[direction]
         entry = {
             "timestamp": datetime.now().isoformat(),
             "direction": direction,
@@ -40,72 +62,141 @@ def save_message(content, direction):
             "is_json": True
         }
         
-        try:
-            parsed = json.loads(content)
-            entry["parsed"] = parsed
-            entry["method"] = parsed.get("method")
-            entry["id"] = parsed.get("id")
-        except:
+        # MCP messages are JSON objects (or batch arrays); anything else is
+        # recorded as non-JSON without going through the parser
+        stripped = content.lstrip()
+        if stripped[:1] in ('{', '['):
+            try:
+                parsed = orjson.loads(stripped)
+                entry["parsed"] = parsed
+                entry["method"] = parsed.get("method")
+                entry["id"] = parsed.get("id")
+            except (orjson.JSONDecodeError, AttributeError):
+                entry["is_json"] = False
+        else:
             entry["is_json"] = False
             
-        with open(file_path, 'a', encoding='utf-8') as f:
-            f.write(json.dumps(entry) + '\n')
+        # One allocation for line + newline, written with a single write() call
+        f.write(orjson.dumps(entry, option=orjson.OPT_APPEND_NEWLINE))
     except Exception as e:
         log(f"Error saving message: {e}")
 
-def forward_stdin(process):
-    """Forward stdin to subprocess"""
-    log("stdin forwarder started")
+def handle_line(name, line, outputs):
+    """Log, capture and forward one line read from stdin/stdout/stderr
+    
+    outputs maps "stdin"/"stdout" to the callable that forwards that stream's bytes
+    """
+    line = line.rstrip(b'\r\n')
+    text = line.decode('utf-8', errors='replace')
+    
+    if name == "stdin":
+        # Forward stdin to subprocess
+        log(f"STDIN: {text}")
+        save_message(text, "request")
+        outputs["stdin"](line + b'\n')
+    elif name == "stdout":
+        # Forward subprocess stdout to stdout
+        log(f"STDOUT: {text}")
+        save_message(text, "response")
+        outputs["stdout"](line + b'\n')
+    else:
+        # Log stderr but don't forward
+        log(f"STDERR: {text.rstrip()}")
+
+def write_and_flush(stream):
+    """Get a callable writing bytes to stream and flushing them"""
+    def write(data):
+        stream.write(data)
+        stream.flush()
+    return write
+
+def write_forwarder(name, stream, outbox, close):
+    """Write queued bytes to stream until a None sentinel, closing it afterwards if close is set
+    
+    Pipe writes can block while the other side is busy; doing them here keeps
+    the selector loop draining the subprocess output in the meantime.
+    """
+    write = write_and_flush(stream)
     try:
-        while True:
-            line = sys.stdin.readline()
-            if not line:
-                break
-            
-            line = line.rstrip('\n')
-            log(f"STDIN: {line}")
-            save_message(line, "request")
-            
-            process.stdin.write(line + '\n')
-            process.stdin.flush()
+        for data in iter(outbox.get, None):
+            write(data)
     except Exception as e:
-        log(f"stdin error: {e}")
+        log(f"{name} writer error: {e}")
     finally:
-        log("stdin forwarder stopped")
+        if close:
+            try:
+                stream.close()
+            except Exception:
+                pass
+
+def forward_stdin(outputs, outbox):
+    """Forward stdin on a thread, then let the writer close the subprocess stdin"""
+    forward_stream("stdin", sys.stdin.buffer, outputs)
+    outbox.put(None)
 
-def forward_stdout(process):
-    """Forward subprocess stdout to stdout"""
-    log("stdout forwarder started")
+def forward_streams(process):
+    """Read all three streams from a single selector loop, writing through one thread per output"""
+    outboxes = {"stdin": queue.Queue(), "stdout": queue.Queue()}
+    # Only the subprocess stdin is closed by its writer (at our stdin EOF)
+    writers = {
+        name: threading.Thread(target=write_forwarder, args=(name, stream, outboxes[name], close), daemon=True)
+        for name, stream, close in (("stdin", process.stdin, True), ("stdout", sys.stdout.buffer, False))
+    }
+    for writer in writers.values():
+        writer.start()
+    outputs = {name: outbox.put for name, outbox in outboxes.items()}
+    
+    sel = selectors.DefaultSelector()
     try:
-        while True:
-            line = process.stdout.readline()
-            if not line:
-                break
+        sel.register(sys.stdin.fileno(), selectors.EVENT_READ, "stdin")
+    except OSError:
+        # epoll can't poll regular files or /dev/null: read stdin on a thread instead
+        threading.Thread(target=forward_stdin, args=(outputs, outboxes["stdin"]), daemon=True).start()
+    sel.register(process.stdout.fileno(), selectors.EVENT_READ, "stdout")
+    sel.register(process.stderr.fileno(), selectors.EVENT_READ, "stderr")
+    pending = {"stdin": b"", "stdout": b"", "stderr": b""}
+    log("stream forwarder started")
+    
+    # Run until the subprocess closes both of its output streams
+    while any(key.data != "stdin" for key in sel.get_map().values()):
+        for key, _ in sel.select():
+            name = key.data
+            try:
+                chunk = os.read(key.fd, 65536)
+                if chunk:
+                    *lines, pending[name] = (pending[name] + chunk).split(b'\n')
+                    for line in lines:
+                        handle_line(name, line, outputs)
+                    continue
                 
-            line = line.rstrip('\n')
-            log(f"STDOUT: {line}")
-            save_message(line, "response")
+                # EOF: flush any unterminated last line
+                if pending[name]:
+                    handle_line(name, pending[name], outputs)
+                if name == "stdin":
+                    # Writer closes the subprocess stdin once queued requests are written
+                    outboxes["stdin"].put(None)
+            except Exception as e:
+                log(f"{name} error: {e}")
             
-            print(line)
-            sys.stdout.flush()
-    except Exception as e:
-        log(f"stdout error: {e}")
-    finally:
-        log("stdout forwarder stopped")
+            sel.unregister(key.fd)
+            log(f"{name} forwarder stopped")
+    
+    sel.close()
+    
+    # Deliver all queued responses before returning
+    outboxes["stdout"].put(None)
+    writers["stdout"].join()
 
-def forward_stderr(process):
-    """Log stderr but don't forward"""
-    log("stderr logger started")
+def forward_stream(name, stream, outputs):
+    """Forward one stream line by line (thread fallback for Windows pipes)"""
+    log(f"{name} forwarder started")
     try:
-        while True:
-            line = process.stderr.readline()
-            if not line:
-                break
-            log(f"STDERR: {line.rstrip()}")
+        for line in iter(stream.readline, b''):
+            handle_line(name, line, outputs)
     except Exception as e:
-        log(f"stderr error: {e}")
+        log(f"{name} error: {e}")
     finally:
-        log("stderr logger stopped")
+        log(f"{name} forwarder stopped")
 
 def main():
     # Get command line arguments
@@ -127,7 +218,6 @@ def main():
     log(f"Session: {session_name}")
     
     # Set environment variables for specific servers
-    import os
     env = os.environ.copy()
     
     if server_name == "brave-search":
@@ -142,26 +232,21 @@ def main():
             stdin=subprocess.PIPE,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
-            text=True,
-            bufsize=0,
             env=env,
             shell=(command.endswith('.cmd') or command.endswith('.bat'))
         )
         
         log(f"Started subprocess PID: {process.pid}")
         
-        # Start forwarding threads
-        stdin_thread = threading.Thread(target=forward_stdin, args=(process,))
-        stdout_thread = threading.Thread(target=forward_stdout, args=(process,))
-        stderr_thread = threading.Thread(target=forward_stderr, args=(process,))
-        
-        stdin_thread.daemon = True
-        stdout_thread.daemon = True
-        stderr_thread.daemon = True
-        
-        stdin_thread.start()
-        stdout_thread.start()
-        stderr_thread.start()
+        if os.name == 'nt':
+            # select() can't poll pipes on Windows: one daemon thread per stream
+            # Each thread blocks only on its own stream, so writes can be made directly
+            outputs = {"stdin": write_and_flush(process.stdin), "stdout": write_and_flush(sys.stdout.buffer)}
+            streams = {"stdin": sys.stdin.buffer, "stdout": process.stdout, "stderr": process.stderr}
+            for name, stream in streams.items():
+                threading.Thread(target=forward_stream, args=(name, stream, outputs), daemon=True).start()
+        else:
+            forward_streams(process)
         
         # Wait for process to complete
         process.wait()
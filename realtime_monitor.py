@@ -5,13 +5,19 @@ Real-time MCP monitoring with anomaly detection
 """
 import time
 import os
-import json
+import orjson
 import pickle
+import queue
+from collections import Counter, deque
+from itertools import islice
 from pathlib import Path
 from datetime import datetime
-from typing import Dict, Optional
+from typing import BinaryIO, Dict, List, Optional
 import sys
 
+from watchdog.events import FileSystemEventHandler
+from watchdog.observers import Observer
+
 # Import detector from same directory
 try:
     from mcp_anomaly_detector import SimpleTopicAnomalyDetector
@@ -20,19 +26,43 @@ except ImportError:
     sys.exit(1)
 
 
+class JsonlChangeHandler(FileSystemEventHandler):
+    """Queue paths of created or modified .jsonl files"""
+    
+    def __init__(self, changes: queue.Queue):
+        self.changes = changes
+    
+    def on_created(self, event):
+        if not event.is_directory and event.src_path.endswith('.jsonl'):
+            self.changes.put(event.src_path)
+    
+    on_modified = on_created
+
+
 class MCPRealtimeMonitor:
     """Real-time MCP monitor with anomaly detection"""
     
-    def __init__(self, baseline_file: str = "mcp_baseline.pkl"):
-        self.data_dir = Path("mcp_captured_data")
-        self.seen_files = set()
-        self.seen_content = {}
+    MAX_OPEN_FILES = 8  # Read handles kept open on monitored files
+    HANDLE_IDLE_TIMEOUT = 60.0  # Seconds before an unused read handle is closed
+    
+    def __init__(self, baseline_file: str = "mcp_baseline.json"):
+        # Absolute real path: the startup scan and watchdog events (FSEvents reports
+        # resolved absolute paths) must key file_offsets by the same path strings
+        self.data_dir = Path("mcp_captured_data").resolve()
+        self.file_offsets: Dict[str, int] = {}  # Bytes already processed per file path
+        self._handles: Dict[str, BinaryIO] = {}  # Open read handles of recently written files, LRU order
+        self._handle_used: Dict[str, float] = {}  # Monotonic time each handle was last read
+        self.out_buf = []  # Console output pending the next flush_output()
+        self._ts_cache = (0, '', '')  # (epoch second, '%H:%M:%S', '%Y-%m-%d %H:%M:%S')
+        self.changes = queue.Queue()
         self.detector = None
-        self.anomaly_log = []
+        self.anomaly_log = deque(maxlen=1000)  # Summaries of the most recent anomalies
+        self.anomaly_log_file = f"anomaly_log_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jsonl"
+        self._anomaly_fp: Optional[BinaryIO] = None  # Opened on the first anomaly
         self.stats = {
             'total_requests': 0,
             'total_anomalies': 0,
-            'anomalies_by_tool': {}
+            'anomalies_by_tool': Counter()
         }
         
         # Load baseline
@@ -50,26 +80,52 @@ class MCPRealtimeMonitor:
             'bold': '\033[1m'
         }
         
-        # Enable color codes on Windows
+        # Pre-colored labels for per-line output
+        self.rule = '=' * 60
+        self.new_file_label = self.colorize('NEW FILE:', 'yellow')
+        self.ok_icon = self.colorize("✓", 'green')
+        self.error_arrow = self.colorize('← ERROR:', 'red')
+        self.alert_headers = {
+            severity: self.colorize(f"{self.rule}\nANOMALY DETECTED - {severity} SEVERITY\n{self.rule}", 'red', bold=True)
+            for severity in ('HIGH', 'MEDIUM')
+        }
+        
+        # Enable color codes on Windows (colorama avoids spawning cmd.exe)
         if os.name == 'nt':
-            os.system('color')
+            try:
+                from colorama import just_fix_windows_console
+                just_fix_windows_console()
+            except ImportError:
+                os.system('color')
     
     def load_baseline(self, baseline_file: str):
         """Load baseline from file"""
         baseline_path = Path(baseline_file)
         
+        # Fall back to a baseline pickled by older builder versions
+        legacy_path = baseline_path.with_suffix('.pkl')
+        if not baseline_path.exists() and legacy_path.exists():
+            baseline_path = legacy_path
+        
         if baseline_path.exists():
             try:
                 with open(baseline_path, 'rb') as f:
-                    baseline_data = pickle.load(f)
-                    self.detector = baseline_data['detector']
-                    print(f"✓ Baseline loaded from {baseline_file}")
+                    if baseline_path.suffix == '.pkl':
+                        baseline_data = pickle.load(f)
+                        self.detector = baseline_data['detector']
+                        self.detector.warm_up()
+                        # Legacy pickles predate the camelCase tokenizer fix
+                        print(f"Warning: {baseline_path} is a legacy baseline built before the camelCase tokenizer fix")
+                        print("  camelCase queries may be reported as false anomalies.")
+                        print("  Rebuild it with: python baseline_builder.py")
+                    else:
+                        baseline_data = orjson.loads(f.read())
+                        self.detector = SimpleTopicAnomalyDetector.from_state(baseline_data['detector'])
+                    print(f"✓ Baseline loaded from {baseline_path}")
                     
-                    # Display learned topics summary
-                    summary = self.detector.get_summary()
-                    print(f"  - Learned tools: {len(summary)}")
-                    total_requests = sum(info['total_requests'] for info in summary.values())
-                    print(f"  - Total requests in baseline: {total_requests}")
+                    # Display learned topics summary (counts only; no per-tool top-topic ranking)
+                    print(f"  - Learned tools: {len(self.detector.tool_topics)}")
+                    print(f"  - Total requests in baseline: {self.detector.total_requests()}")
                     
             except Exception as e:
                 print(f"Warning: Error loading baseline: {e}")
@@ -81,6 +137,25 @@ class MCPRealtimeMonitor:
             self.detector = SimpleTopicAnomalyDetector(sensitivity=0.7)
             print("  Run 'python mcp_baseline_builder.py' to create a baseline.")
     
+    def _now_strs(self) -> tuple:
+        """Get (epoch second, HH:MM:SS, full date-time) for now, formatted once per second"""
+        t = int(time.time())
+        if t != self._ts_cache[0]:
+            lt = time.localtime(t)
+            self._ts_cache = (t, time.strftime('%H:%M:%S', lt), time.strftime('%Y-%m-%d %H:%M:%S', lt))
+        return self._ts_cache
+    
+    def emit(self, line: str):
+        """Queue a line of console output"""
+        self.out_buf.append(line + '\n')
+    
+    def flush_output(self):
+        """Write queued console output with a single write and flush"""
+        if self.out_buf:
+            sys.stdout.write(''.join(self.out_buf))
+            sys.stdout.flush()
+            self.out_buf.clear()
+    
     def colorize(self, text: str, color: str, bold: bool = False) -> str:
         """Add color to text"""
         result = self.colors.get(color, '')
@@ -89,48 +164,79 @@ class MCPRealtimeMonitor:
         result += text + self.colors['reset']
         return result
     
-    def check_anomaly(self, data: dict) -> Optional[Dict]:
-        """Check request for anomalies"""
-        if not self.detector:
-            return None
-            
-        # Only check tools/call
-        if data.get('parsed', {}).get('method') != 'tools/call':
-            return None
-            
+    def check_anomalies(self, requests: List[dict]) -> List[Optional[Dict]]:
+        """Check a batch of tools/call requests with a single detector call"""
+        if not self.detector or not requests:
+            return [None] * len(requests)
+        
+        results = self._detect(requests)
+        if results is None:
+            return [None] * len(requests)
+        
+        logged = False
+        for result in results:
+            logged |= self._update_stats(result)
+        
+        # One flush per batch keeps the log file current without a flush per anomaly
+        if logged:
+            self._anomaly_fp.flush()
+        
+        return results
+    
+    def _detect(self, requests: List[dict]) -> Optional[List[Dict]]:
+        """Score tools/call requests with one detector call; None if detection fails"""
         try:
-            result = self.detector.detect_anomaly(data)
-            
-            # Update statistics
-            self.stats['total_requests'] += 1
-            
-            if result['is_anomaly']:
-                self.stats['total_anomalies'] += 1
-                tool = result.get('tool', 'unknown')
-                self.stats['anomalies_by_tool'][tool] = self.stats['anomalies_by_tool'].get(tool, 0) + 1
-                self.anomaly_log.append({
-                    'timestamp': datetime.now(),
-                    'result': result,
-                    'data': data
-                })
-                
-            return result
-            
+            return self.detector.detect_anomaly_batch(requests)
         except Exception as e:
-            print(f"Error in anomaly detection: {e}")
+            self.emit(f"Error in anomaly detection: {e}")
             return None
     
+    def _update_stats(self, result: Dict) -> bool:
+        """Count a detection result, logging it if anomalous; True if it was logged"""
+        self.stats['total_requests'] += 1
+        if not result['is_anomaly']:
+            return False
+        
+        self.stats['total_anomalies'] += 1
+        self.stats['anomalies_by_tool'][result.get('tool', 'unknown')] += 1
+        entry = {
+            'timestamp': time.time(),
+            'tool': result['tool'],
+            'query': result['query'],
+            'confidence': result['confidence'],
+            'new_topics': result.get('new_topics', []),
+            'reason': result['reason']
+        }
+        self.anomaly_log.append(entry)
+        self.log_anomaly(entry)
+        return True
+    
+    def log_anomaly(self, entry: Dict):
+        """Append an anomaly summary to the JSONL anomaly log"""
+        if self._anomaly_fp is None:
+            self._anomaly_fp = open(self.anomaly_log_file, 'ab')
+        # orjson serializes datetime timestamps natively (ISO 8601)
+        self._anomaly_fp.write(orjson.dumps(
+            dict(entry, timestamp=datetime.fromtimestamp(entry['timestamp'])),
+            option=orjson.OPT_APPEND_NEWLINE
+        ))
+    
+    def is_tool_call(self, data: dict) -> bool:
+        """Check if a captured entry is a tools/call request"""
+        parsed = data.get('parsed')
+        return (data.get('direction') == 'request' and isinstance(parsed, dict)
+                and parsed.get('method') == 'tools/call')
+    
     def format_anomaly_alert(self, result: Dict) -> str:
         """Format anomaly alert message"""
         alert_lines = []
         
         # Header
         severity = "HIGH" if result['confidence'] > 0.9 else "MEDIUM"
-        header = f"{'='*60}\nANOMALY DETECTED - {severity} SEVERITY\n{'='*60}"
-        alert_lines.append(self.colorize(header, 'red', bold=True))
+        alert_lines.append(self.alert_headers[severity])
         
         # Details
-        alert_lines.append(f"Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+        alert_lines.append(f"Time: {self._now_strs()[2]}")
         alert_lines.append(f"Tool: {self.colorize(result['tool'], 'yellow')}")
         alert_lines.append(f"Query: {self.colorize(result['query'][:100], 'cyan')}")
         alert_lines.append(f"Confidence: {self.colorize(f'{result["confidence"]:.1%}', 'red', bold=True)}")
@@ -148,7 +254,7 @@ class MCPRealtimeMonitor:
             common = ', '.join(result['common_topics'][:3])
             alert_lines.append(f"Expected topics: {self.colorize(common, 'green')}")
         
-        alert_lines.append('='*60)
+        alert_lines.append(self.rule)
         
         return '\n'.join(alert_lines)
     
@@ -160,96 +266,194 @@ class MCPRealtimeMonitor:
         print(f"Anomaly detection: {self.colorize('ENABLED', 'green') if self.detector else self.colorize('DISABLED', 'red')}")
         print("Press Ctrl+C to stop\n")
         
-        # Initialize existing files
-        if self.data_dir.exists():
-            for f in self.data_dir.rglob("*.jsonl"):
-                self.seen_files.add(f)
-                try:
-                    with open(f, 'r', encoding='utf-8') as file:
-                        self.seen_content[f] = sum(1 for _ in file)
-                except:
-                    self.seen_content[f] = 0
+        # Output is flushed once per batch; stop the Windows console flushing every newline
+        if os.name == 'nt':
+            sys.stdout.reconfigure(line_buffering=False, write_through=False)
+        
+        # Initialize existing files: only content appended from now on is processed
+        self.data_dir.mkdir(exist_ok=True)
+        for path, st in self._iter_jsonl():
+            self.file_offsets[path] = st.st_size
+        
+        # Watch for file creation/modification instead of rescanning
+        observer = Observer()
+        observer.schedule(JsonlChangeHandler(self.changes), str(self.data_dir), recursive=True)
+        observer.start()
         
         try:
             while True:
-                if self.data_dir.exists():
-                    # Check for new files
-                    for f in self.data_dir.rglob("*.jsonl"):
-                        if f not in self.seen_files:
-                            print(f"\n[{datetime.now().strftime('%H:%M:%S')}] {self.colorize('NEW FILE:', 'yellow')} {f.relative_to(self.data_dir)}")
-                            self.seen_files.add(f)
-                            self.seen_content[f] = 0
-                        
-                        # Check for new content in existing files
-                        try:
-                            with open(f, 'r', encoding='utf-8') as file:
-                                lines = file.readlines()
-                                current_count = len(lines)
-                                
-                                if current_count > self.seen_content.get(f, 0):
-                                    # Process new lines
-                                    for line in lines[self.seen_content.get(f, 0):]:
-                                        try:
-                                            data = json.loads(line)
-                                            self.process_data(data)
-                                            
-                                        except json.JSONDecodeError:
-                                            print(f"[{datetime.now().strftime('%H:%M:%S')}] Invalid JSON: {line[:100]}")
-                                        except Exception as e:
-                                            print(f"[{datetime.now().strftime('%H:%M:%S')}] Error: {e}")
-                                    
-                                    self.seen_content[f] = current_count
-                                    
-                        except Exception as e:
-                            pass
+                self.close_idle_handles()
+                
+                # Timeout only keeps Ctrl+C responsive (Windows can't interrupt a blocking get)
+                try:
+                    changed = [self.changes.get(timeout=1.0)]
+                except queue.Empty:
+                    # Windows may report writes to files the proxy keeps open late (or only
+                    # when it exits), so check for growth while no events arrive
+                    changed = self.poll_grown_files()
+                    if not changed:
+                        continue
+                
+                # Drain every change queued so far into one batch
+                while True:
+                    try:
+                        changed.append(self.changes.get_nowait())
+                    except queue.Empty:
+                        break
+                
+                records = []
+                for f in dict.fromkeys(changed):
+                    records.extend(self.read_new_records(f))
+                
+                # Detect anomalies for all new tools/call requests at once
+                calls = [data for data, is_call in records if is_call]
+                results = iter(self.check_anomalies(calls))
+                
+                for data, is_call in records:
+                    try:
+                        self.process_data(data, next(results) if is_call else None)
+                    except Exception as e:
+                        self.emit(f"[{self._now_strs()[1]}] Error: {e}")
                 
-                time.sleep(0.5)  # Check every 500ms
+                self.flush_output()
                 
         except KeyboardInterrupt:
+            self.flush_output()
             self.show_summary()
+        finally:
+            observer.stop()
+            observer.join()
+            self.close_handles()
+    
+    def close_handles(self):
+        """Close the read handles kept open on monitored files"""
+        for h in self._handles.values():
+            h.close()
+        self._handles.clear()
+        self._handle_used.clear()
+    
+    def close_idle_handles(self):
+        """Close handles not read within HANDLE_IDLE_TIMEOUT, releasing files of ended sessions"""
+        cutoff = time.monotonic() - self.HANDLE_IDLE_TIMEOUT
+        # _handles is in least recently used order, so idle handles come first
+        for f in list(self._handles):
+            if self._handle_used[f] > cutoff:
+                break
+            self._close_handle(f)
+    
+    def _close_handle(self, f: str):
+        """Close the read handle of a file; file_offsets keeps its resume position"""
+        self._handles.pop(f).close()
+        del self._handle_used[f]
+    
+    def poll_grown_files(self) -> List[str]:
+        """Get monitored files whose size is past their processed offset"""
+        grown = []
+        for f, offset in self.file_offsets.items():
+            try:
+                if os.stat(f).st_size > offset:
+                    grown.append(f)
+            except OSError:
+                continue
+        return grown
+    
+    def _iter_jsonl(self):
+        """Yield (path, stat) for every .jsonl file under data_dir using os.scandir"""
+        stack = [str(self.data_dir)]
+        while stack:
+            try:
+                with os.scandir(stack.pop()) as entries:
+                    for entry in entries:
+                        if entry.is_dir():
+                            stack.append(entry.path)
+                        elif entry.name.endswith('.jsonl'):
+                            yield entry.path, entry.stat()
+            except OSError:
+                continue
+    
+    def read_new_records(self, f: str) -> list:
+        """Read entries appended to a file as (data, is_tool_call) pairs"""
+        if f not in self.file_offsets:
+            self.emit(f"\n[{self._now_strs()[1]}] {self.new_file_label} {os.path.relpath(f, self.data_dir)}")
+            self.file_offsets[f] = 0
+        
+        # Read only the bytes appended since the last read, through a handle kept
+        # open to follow the file's tail. Reinsert it as the most recently used and
+        # close the least recently used one beyond MAX_OPEN_FILES
+        try:
+            h = self._handles.pop(f, None)
+            if h is None:
+                h = open(f, 'rb')
+                h.seek(self.file_offsets[f])
+            self._handles[f] = h
+            self._handle_used[f] = time.monotonic()
+            if len(self._handles) > self.MAX_OPEN_FILES:
+                self._close_handle(next(iter(self._handles)))
+            chunk = h.read()
+        except OSError:
+            return []
+        
+        # Leave an unterminated last line for the next read (the writer may be mid-line)
+        *lines, tail = chunk.split(b'\n')
+        self.file_offsets[f] += len(chunk) - len(tail)
+        if tail:
+            h.seek(self.file_offsets[f])
+        
+        records = []
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                data = orjson.loads(line)
+                records.append((data, self.is_tool_call(data)))
+                
+            except orjson.JSONDecodeError:
+                self.emit(f"[{self._now_strs()[1]}] Invalid JSON: {line[:100].decode('utf-8', errors='replace')}")
+            except Exception as e:
+                self.emit(f"[{self._now_strs()[1]}] Error: {e}")
+        
+        return records
     
-    def process_data(self, data: dict):
-        """Process data and check for anomalies"""
-        timestamp = data.get('timestamp', '')
+    def process_data(self, data: dict, anomaly_result: Optional[Dict] = None):
+        """Process data and display it, using the anomaly result for tools/call requests"""
+        parsed = data.get('parsed')
+        if not parsed:
+            return
+        
         direction = data.get('direction', '')
+        method = parsed.get('method', '')
+        id_val = parsed.get('id', '')
         
-        if data.get('parsed'):
-            method = data['parsed'].get('method', '')
-            id_val = data['parsed'].get('id', '')
-            
-            # Process requests
-            if direction == 'request':
-                # Normal display
-                if method == 'tools/call':
-                    # Anomaly detection
-                    anomaly_result = self.check_anomaly(data)
-                    
-                    if anomaly_result and anomaly_result['is_anomaly']:
-                        # Display anomaly alert
-                        print(f"\n{self.format_anomaly_alert(anomaly_result)}")
-                    else:
-                        # Display normal request (concise)
-                        params = data['parsed'].get('params', {})
-                        tool_name = params.get('name', 'unknown')
-                        args = params.get('arguments', {})
-                        
-                        # Extract query text
-                        query_preview = ""
-                        for field in ['query', 'pattern', 'sql', 'text']:
-                            if field in args:
-                                query_preview = str(args[field])[:50]
-                                break
-                        
-                        status_icon = self.colorize("✓", 'green') if anomaly_result and not anomaly_result['is_anomaly'] else ""
-                        print(f"[{datetime.now().strftime('%H:%M:%S')}] {status_icon} → {tool_name}: {query_preview}...")
+        # Process requests
+        if direction == 'request':
+            # Normal display
+            if method == 'tools/call':
+                if anomaly_result and anomaly_result['is_anomaly']:
+                    # Display anomaly alert
+                    self.emit(f"\n{self.format_anomaly_alert(anomaly_result)}")
                 else:
-                    # Non-tools/call methods
-                    print(f"[{datetime.now().strftime('%H:%M:%S')}] → {method} (id: {id_val})")
-            
-            # Process responses (only show errors)
-            elif direction == 'response' and 'error' in data['parsed']:
-                error = data['parsed']['error']
-                print(f"[{datetime.now().strftime('%H:%M:%S')}] {self.colorize('← ERROR:', 'red')} {error['message']}")
+                    # Display normal request (concise)
+                    params = parsed.get('params', {})
+                    tool_name = params.get('name', 'unknown')
+                    args = params.get('arguments', {})
+                    
+                    # Extract query text
+                    query_preview = ""
+                    for field in ['query', 'pattern', 'sql', 'text']:
+                        if field in args:
+                            query_preview = str(args[field])[:50]
+                            break
+                    
+                    status_icon = self.ok_icon if anomaly_result and not anomaly_result['is_anomaly'] else ""
+                    self.emit(f"[{self._now_strs()[1]}] {status_icon} → {tool_name}: {query_preview}...")
+            else:
+                # Non-tools/call methods
+                self.emit(f"[{self._now_strs()[1]}] → {method} (id: {id_val})")
+        
+        # Process responses (only show errors)
+        elif direction == 'response' and 'error' in parsed:
+            error = parsed['error']
+            self.emit(f"[{self._now_strs()[1]}] {self.error_arrow} {error['message']}")
     
     def show_summary(self):
         """Display monitoring summary"""
@@ -278,29 +482,20 @@ class MCPRealtimeMonitor:
         # Anomalies by tool
         if self.stats['anomalies_by_tool']:
             print(f"\n{self.colorize('Anomalies by tool:', 'yellow')}")
-            for tool, count in sorted(self.stats['anomalies_by_tool'].items(), key=lambda x: x[1], reverse=True):
+            for tool, count in self.stats['anomalies_by_tool'].most_common():
                 print(f"  - {tool}: {count}")
         
         # Recent anomalies
         if self.anomaly_log:
             print(f"\n{self.colorize('Recent anomalies:', 'yellow')}")
-            for entry in self.anomaly_log[-5:]:  # Last 5
-                result = entry['result']
-                print(f"  - [{entry['timestamp'].strftime('%H:%M:%S')}] {result['tool']}: {result['query'][:40]}...")
+            for entry in islice(self.anomaly_log, max(len(self.anomaly_log) - 5, 0), None):  # Last 5
+                print(f"  - [{time.strftime('%H:%M:%S', time.localtime(entry['timestamp']))}] {entry['tool']}: {entry['query'][:40]}...")
         
-        # Save anomaly log
-        if self.anomaly_log:
-            log_file = f"anomaly_log_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-            with open(log_file, 'w', encoding='utf-8') as f:
-                json.dump([{
-                    'timestamp': entry['timestamp'].isoformat(),
-                    'tool': entry['result']['tool'],
-                    'query': entry['result']['query'],
-                    'confidence': entry['result']['confidence'],
-                    'new_topics': entry['result'].get('new_topics', []),
-                    'reason': entry['result']['reason']
-                } for entry in self.anomaly_log], f, indent=2, ensure_ascii=False)
-            print(f"\n✓ Anomaly log saved to: {log_file}")
+        # Anomaly log entries were written as they were detected
+        if self._anomaly_fp is not None:
+            self._anomaly_fp.close()
+            self._anomaly_fp = None
+            print(f"\n✓ Anomaly log saved to: {self.anomaly_log_file}")
 
 
 def main():
@@ -5,10 +5,32 @@ Configure Claude Desktop to use MCPSentinel proxy for monitoring
 """
 
 import json
+import orjson
 from pathlib import Path
 import sys
 import os
 import ctypes
+from ctypes import wintypes
+
+
+TH32CS_SNAPPROCESS = 0x00000002
+INVALID_HANDLE_VALUE = ctypes.c_void_p(-1).value
+
+
+class PROCESSENTRY32W(ctypes.Structure):
+    """Win32 Toolhelp process entry"""
+    _fields_ = [
+        ('dwSize', wintypes.DWORD),
+        ('cntUsage', wintypes.DWORD),
+        ('th32ProcessID', wintypes.DWORD),
+        ('th32DefaultHeapID', ctypes.c_size_t),
+        ('th32ModuleID', wintypes.DWORD),
+        ('cntThreads', wintypes.DWORD),
+        ('th32ParentProcessID', wintypes.DWORD),
+        ('pcPriClassBase', wintypes.LONG),
+        ('dwFlags', wintypes.DWORD),
+        ('szExeFile', wintypes.WCHAR * 260),
+    ]
 
 
 class ProxyConfigurator:
@@ -147,10 +169,15 @@ class ProxyConfigurator:
     def check_claude_running(self):
         """Check if Claude Desktop is running"""
         try:
-            import subprocess
-            result = subprocess.run(['tasklist', '/FI', 'IMAGENAME eq Claude.exe'], 
-                                  capture_output=True, text=True)
-            if 'Claude.exe' in result.stdout:
+            try:
+                running = is_process_running('Claude.exe')
+            except OSError:
+                # Toolhelp API unavailable: fall back to tasklist
+                import subprocess
+                result = subprocess.run(['tasklist', '/FI', 'IMAGENAME eq Claude.exe'], 
+                                      capture_output=True, text=True)
+                running = 'Claude.exe' in result.stdout
+            if running:
                 print("\n⚠️ WARNING: Claude Desktop appears to be running!")
                 print("Please close Claude Desktop before updating the configuration.")
                 response = input("Continue anyway? (y/N): ")
@@ -198,20 +225,23 @@ class ProxyConfigurator:
                 
         # Save updated configuration
         print("\nSaving configuration...")
+        # Serialize once; the same bytes are previewed, written and verified
+        config_bytes = orjson.dumps(config, option=orjson.OPT_INDENT_2)
+        config_text = config_bytes.decode('utf-8')
         print(f"Final config preview:")
-        print(json.dumps(config, indent=2)[:500] + "..." if len(json.dumps(config)) > 500 else json.dumps(config, indent=2))
+        print(config_text[:500] + "..." if len(config_text) > 500 else config_text)
         
         try:
             # Write to temporary file first
             temp_file = self.claude_config_path.with_suffix('.tmp')
-            with open(temp_file, 'w', encoding='utf-8') as f:
-                json.dump(config, f, indent=2)
+            with open(temp_file, 'wb') as f:
+                f.write(config_bytes)
             
-            # Verify the temporary file was written correctly
-            with open(temp_file, 'r', encoding='utf-8') as f:
-                verify_config = json.load(f)
+            # Verify the temporary file was written correctly (byte-level compare)
+            with open(temp_file, 'rb') as f:
+                written_ok = f.read() == config_bytes
             
-            if verify_config == config:
+            if written_ok:
                 # Replace the original file
                 import shutil
                 shutil.move(str(temp_file), str(self.claude_config_path))
@@ -282,6 +312,41 @@ class ProxyConfigurator:
         return True
 
 
+def is_process_running(image_name):
+    """Check for a running process by executable name using the Win32 Toolhelp API
+    
+    Raises OSError when the API is unavailable (e.g. not on Windows)
+    """
+    if not hasattr(ctypes, 'WinDLL'):
+        raise OSError("Toolhelp API requires Windows")
+    
+    kernel32 = ctypes.WinDLL('kernel32', use_last_error=True)
+    kernel32.CreateToolhelp32Snapshot.argtypes = [wintypes.DWORD, wintypes.DWORD]
+    kernel32.CreateToolhelp32Snapshot.restype = wintypes.HANDLE
+    kernel32.Process32FirstW.argtypes = [wintypes.HANDLE, ctypes.POINTER(PROCESSENTRY32W)]
+    kernel32.Process32FirstW.restype = wintypes.BOOL
+    kernel32.Process32NextW.argtypes = [wintypes.HANDLE, ctypes.POINTER(PROCESSENTRY32W)]
+    kernel32.Process32NextW.restype = wintypes.BOOL
+    kernel32.CloseHandle.argtypes = [wintypes.HANDLE]
+    
+    snapshot = kernel32.CreateToolhelp32Snapshot(TH32CS_SNAPPROCESS, 0)
+    if snapshot == INVALID_HANDLE_VALUE:
+        raise ctypes.WinError(ctypes.get_last_error())
+    
+    try:
+        image_name = image_name.lower()
+        entry = PROCESSENTRY32W()
+        entry.dwSize = ctypes.sizeof(PROCESSENTRY32W)
+        found = kernel32.Process32FirstW(snapshot, ctypes.byref(entry))
+        while found:
+            if entry.szExeFile.lower() == image_name:
+                return True
+            found = kernel32.Process32NextW(snapshot, ctypes.byref(entry))
+        return False
+    finally:
+        kernel32.CloseHandle(snapshot)
+
+
 def is_admin():
     """Check if running with administrator privileges"""
     try:
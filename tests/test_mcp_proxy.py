@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Regression tests for mcp_proxy.py stream forwarding
+"""
+
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+import orjson
+
+PROXY_SCRIPT = Path(__file__).resolve().parent.parent / "mcp_proxy.py"
+
+# Larger than a pipe buffer (64 KiB on Linux) so that forwarding blocks on full pipes
+PAYLOAD_SIZE = 300_000
+
+# Writes a large response before reading the large request: a proxy that stops
+# draining the child's stdout while writing the request to it deadlocks here
+CHILD_SCRIPT = f"""
+import sys
+sys.stdout.write('{{"jsonrpc": "2.0", "id": 1, "result": "' + 'r' * {PAYLOAD_SIZE} + '"}}\\n')
+sys.stdout.flush()
+request = sys.stdin.readline()
+sys.stdout.write('{{"jsonrpc": "2.0", "id": 2, "result": %d}}\\n' % len(request))
+sys.stdout.flush()
+"""
+
+
+# Waits for stdin EOF, so it only exits if the proxy closes the child's stdin
+EOF_CHILD_SCRIPT = """
+import sys
+sys.stdin.read()
+sys.stdout.write('{"jsonrpc": "2.0", "id": 1, "result": "done"}\\n')
+"""
+
+
+class ProxyForwardingTest(unittest.TestCase):
+    """Forward messages between the client and the MCP server subprocess"""
+
+    def setUp(self):
+        # The proxy writes its log and captured data next to the script
+        self.work_dir = Path(tempfile.mkdtemp())
+        shutil.copy(PROXY_SCRIPT, self.work_dir / "mcp_proxy.py")
+        (self.work_dir / "child.py").write_text(CHILD_SCRIPT)
+        (self.work_dir / "eof_child.py").write_text(EOF_CHILD_SCRIPT)
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def test_large_request_and_response(self):
+        request = orjson.dumps({
+            "jsonrpc": "2.0", "id": 1, "method": "tools/call",
+            "params": {"name": "query", "arguments": {"query": "q" * PAYLOAD_SIZE}}
+        }) + b"\n"
+
+        proxy = subprocess.Popen(
+            [sys.executable, str(self.work_dir / "mcp_proxy.py"), "svc",
+             sys.executable, str(self.work_dir / "child.py")],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            cwd=self.work_dir
+        )
+        try:
+            stdout, _ = proxy.communicate(request, timeout=30)
+        except subprocess.TimeoutExpired:
+            proxy.kill()
+            proxy.communicate()
+            self.fail("proxy deadlocked forwarding large messages")
+
+        self.assertEqual(proxy.returncode, 0)
+        responses = [orjson.loads(line) for line in stdout.splitlines()]
+        self.assertEqual(len(responses), 2)
+        self.assertEqual(len(responses[0]["result"]), PAYLOAD_SIZE)
+        self.assertEqual(responses[1]["result"], len(request))
+
+        # Both directions are captured for the monitor
+        session_dir, = (self.work_dir / "mcp_captured_data").iterdir()
+        captured = orjson.loads((session_dir / "requests.jsonl").read_bytes())
+        self.assertEqual(captured["parsed"]["params"]["arguments"]["query"], "q" * PAYLOAD_SIZE)
+        self.assertEqual(len((session_dir / "responses.jsonl").read_bytes().splitlines()), 2)
+
+    def test_stdin_not_pollable(self):
+        # epoll refuses /dev/null, so stdin has to be read on a thread
+        proxy = subprocess.run(
+            [sys.executable, str(self.work_dir / "mcp_proxy.py"), "svc",
+             sys.executable, str(self.work_dir / "eof_child.py")],
+            stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            cwd=self.work_dir, timeout=30
+        )
+
+        self.assertEqual(proxy.returncode, 0)
+        self.assertEqual(orjson.loads(proxy.stdout), {"jsonrpc": "2.0", "id": 1, "result": "done"})
+
+
+if __name__ == "__main__":
+    unittest.main()